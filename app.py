@@ -1,38 +1,106 @@
 """
-Invoice Scanner: OCR + TensorFlow (optional classifier) + Streamlit UI
+Invoice Scanner: OCR + regex field extraction + Streamlit UI
 
 Features
 - Upload invoice/receipt (PNG/JPG/JPEG/PDF)
 - OCR via Tesseract (pytesseract)
 - Heuristic extraction (regex for dates, currency amounts, invoice numbers)
-- Optional TensorFlow text classifier to tag lines as DATE / TOTAL / INVOICE_NUMBER / VENDOR / OTHER
-  * You can train it inside the app from a small labeled CSV and it will be saved to ./models/invoice_line_classifier
 - Export structured results (JSON & CSV) with download buttons
 
 Notes
-- For PDF support, install poppler on your OS so pdf2image can convert PDFs to images.
-  * Windows: https://github.com/oschwartz10612/poppler-windows/releases/ (add bin folder to PATH)
-  * macOS (Homebrew): brew install poppler
-  * Linux (Debian/Ubuntu): sudo apt-get install poppler-utils
+- PDFs are read and rendered in-process with PyMuPDF; no poppler install is needed.
+- OCR needs the Tesseract binary installed and on PATH.
 
 Author: Dawn
 """
 
+import os
+
+# Tesseract's OpenMP threading makes single-page OCR slower, not faster.
+# Pin it to one thread before pytesseract (and the tesseract processes it spawns) picks it up.
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 import streamlit as st
 import pytesseract
-import fitz  # PyMuPDF
-import re
+import csv
+import hashlib
+import io
 import json
-import os
-import pandas as pd
-from datetime import datetime
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import combinations
+from pathlib import Path
 from PIL import Image
 
+try:
+    # google-re2: linear-time DFA matching on long, noisy OCR text. Its \w, \d and \s are
+    # ASCII-only, so dates with accented month names ("18 Août 2025") need the re fallback.
+    import re2 as re
+except ImportError:
+    import re
+
+logger = logging.getLogger(__name__)
+
 # --- Ensure directories exist ---
 os.makedirs("uploads", exist_ok=True)
 os.makedirs("processed", exist_ok=True)
 
+# OCR output is cached here by upload content hash, so re-uploads skip Tesseract
+OCR_CACHE_DIR = os.path.join("processed", "ocr_cache")
+os.makedirs(OCR_CACHE_DIR, exist_ok=True)
+
+# --- Invoice field patterns (fused into a single pass over the text) ---
+_FIELD_PATTERNS = {
+    # Invoice Number (e.g. Invoice #12345)
+    "inv": r"(?i:Invoice\s*#?:?\s*(?P<invval>[A-Za-z0-9\-]+))",
+    # Dates (DD-MM-YYYY, YYYY-MM-DD, DD/MM/YYYY, 18 Aug 2025, etc.)
+    "date": r"(?P<dateval>\d{2}[/-]\d{2}[/-]\d{4}|\d{4}[/-]\d{2}[/-]\d{2}|\d{1,2}\s+\w+\s+\d{4})",
+    # Totals (Total, Grand Total, Amount Due, Balance)
+    "total": r"(?i:(?:Total\s*Amount\s*:?|Grand\s*Total|Amount\s*Due|Balance)\s*\$?(?P<totalval>[\d,]+\.\d{2}))",
+}
+
+# Every match of a pattern contains one of its keywords once the text is folded with
+# _KEYWORD_FOLDS and lower-cased; dates have none
+_FIELD_KEYWORDS = {
+    "inv": ("invoice",),
+    "date": (),
+    "total": ("total", "amount", "balance"),
+}
+
+# Non-ASCII characters that (?i) matches against an ASCII letter but str.lower() does not
+# turn into that letter (Kelvin sign K already lowers to k)
+_KEYWORD_FOLDS = str.maketrans({"\u0130": "i", "\u0131": "i", "\u017f": "s"})
+
+# Named group of each alternative -> (output field, group holding the value)
+_FIELD_GROUPS = {
+    "inv": ("Invoice Number", "invval"),
+    "date": ("Invoice Date", "dateval"),
+    "total": ("Total Amount", "totalval"),
+}
+
+
+# Streamlit re-executes this script on every interaction; cache_resource builds the
+# matchers once per process instead of recompiling them on each rerun.
+# re2's DFA scans an alternation in one pass, so it gets one fused matcher per non-empty
+# subset of fields (at most 7), keyed by the tuple of pattern names, with a named group
+# per alternative for dispatch. Stdlib re is faster running the plain single-field
+# patterns one after another, so it only gets those.
+# Case-insensitivity is a scoped (?i:...) group because re2 has no re.IGNORECASE.
+@st.cache_resource
+def compile_fields_re():
+    if re.__name__ != "re2":
+        return {(name,): re.compile(pattern) for name, pattern in _FIELD_PATTERNS.items()}
+    return {
+        names: re.compile("|".join(f"(?P<{name}>{_FIELD_PATTERNS[name]})" for name in names))
+        for size in range(1, len(_FIELD_PATTERNS) + 1)
+        for names in combinations(_FIELD_PATTERNS, size)
+    }
+
+
 # --- Invoice field extraction function ---
+@st.cache_data(max_entries=128)
 def extract_invoice_fields(text):
     fields = {
         "Invoice Number": None,
@@ -40,76 +108,224 @@ def extract_invoice_fields(text):
         "Total Amount": None,
     }
 
-    # Invoice Number (e.g. Invoice #12345)
-    invoice_number_match = re.search(r"(Invoice\s*#?:?\s*)([A-Za-z0-9\-]+)", text, re.IGNORECASE)
+    # Nothing to scan, e.g. when OCR is unavailable
+    if not text or not text.strip():
+        return fields
 
-    # Dates (DD-MM-YYYY, YYYY-MM-DD, DD/MM/YYYY, 18 Aug 2025, etc.)
-    date_match = re.search(
-        r"(\d{2}[/-]\d{2}[/-]\d{4}|\d{4}[/-]\d{2}[/-]\d{2}|\d{1,2}\s+\w+\s+\d{4})",
-        text
+    # Substring checks are much cheaper than regex: leave out patterns whose keyword is absent
+    lowered = text.lower() if text.isascii() else text.translate(_KEYWORD_FOLDS).lower()
+    names = tuple(
+        name for name, keywords in _FIELD_KEYWORDS.items()
+        if not keywords or any(keyword in lowered for keyword in keywords)
     )
 
-    # Totals (Total, Grand Total, Amount Due, Balance)
-    total_match = re.search(
-        r"(Total\s*Amount\s*:?|Grand\s*Total|Amount\s*Due|Balance)\s*\$?([\d,]+\.\d{2})",
-        text,
-        re.IGNORECASE
-    )
+    matchers = compile_fields_re()
+    if re.__name__ != "re2":
+        # One search per field, each with its own literal-prefix and charset fast paths
+        for name in names:
+            match = matchers[(name,)].search(text)
+            if match:
+                field, group = _FIELD_GROUPS[name]
+                fields[field] = match.group(group)
+        return fields
 
-    if invoice_number_match:
-        fields["Invoice Number"] = invoice_number_match.group(2)
-    if date_match:
-        fields["Invoice Date"] = date_match.group(1)
-    if total_match:
-        fields["Total Amount"] = total_match.group(2)
+    # Each search finds the leftmost match of any still-missing field. That field then drops
+    # out of the pattern and the next search resumes where the match began, so a match never
+    # consumes text another field needs: the result equals one re.search per field.
+    pos = 0
+    while names:
+        match = matchers[names].search(text, pos)
+        if match is None:
+            break
+        field, group = _FIELD_GROUPS[match.lastgroup]
+        fields[field] = match.group(group)
+        names = tuple(name for name in names if name != match.lastgroup)
+        pos = match.start()
 
     return fields
 
 
+# --- OCR helper ---
+# Tesseract page segmentation modes offered in the sidebar; 6 fits most invoice layouts
+PSM_MODES = {
+    6: "6 - Single uniform block of text",
+    4: "4 - Single column of variable-size text",
+    3: "3 - Fully automatic",
+    11: "11 - Sparse text",
+}
+
+
+# Long edge cap for uploaded images; phone photos are often 3000+ px. PDF pages are not
+# capped: they are already rendered at OCR_DPI, and resampling them would only cost time.
+MAX_OCR_EDGE = 2000
+
+
+def otsu_threshold(histogram):
+    # Gray level that best separates ink from paper (maximum between-class variance)
+    total = sum(histogram)
+    sum_all = sum(level * count for level, count in enumerate(histogram))
+    weight_bg = sum_bg = 0
+    best_level, best_variance = 0, -1.0
+    for level, count in enumerate(histogram):
+        weight_bg += count
+        weight_fg = total - weight_bg
+        if weight_bg == 0:
+            continue
+        if weight_fg == 0:
+            break
+        sum_bg += level * count
+        mean_bg = sum_bg / weight_bg
+        mean_fg = (sum_all - sum_bg) / weight_fg
+        variance = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+        if variance > best_variance:
+            best_level, best_variance = level, variance
+    return best_level
+
+
+def prep(image, max_edge=MAX_OCR_EDGE):
+    # Grayscale, downscale (if max_edge is set) and binarize so Tesseract has fewer pixels to process
+    gray = image if image.mode == "L" else image.convert("L")
+    scale = max_edge / max(gray.size) if max_edge else 1
+    if scale < 1:
+        size = (max(1, round(gray.width * scale)), max(1, round(gray.height * scale)))
+        gray = gray.resize(size, Image.Resampling.LANCZOS)
+    threshold = otsu_threshold(gray.histogram())
+    return gray.point(lambda p: 255 if p > threshold else 0, mode="1")
+
+
+def ocr_image(image, psm=6, max_edge=MAX_OCR_EDGE):
+    # LSTM engine only, pairs with the tessdata_fast models (see README). The dot-product
+    # kernel is left to Tesseract's runtime SIMD (AVX2/FMA) detection.
+    config = f"--oem 1 --psm {psm}"
+    return pytesseract.image_to_string(prep(image, max_edge), lang="eng", config=config)
+
+
+def ocr_pages(images, psm=6, workers=1):
+    # pytesseract runs every page in its own tesseract process, so threads parallelize it fine.
+    # Only `workers` pages are in flight at once, so long scans are never all held in memory.
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for image in images:
+            pending.append(executor.submit(ocr_image, image, psm, None))
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# --- PDF rendering helpers ---
+OCR_DPI = 200
+PREVIEW_DPI = 72
+
+
+# PyMuPDF is imported inside the PDF code paths so image-only sessions never load it
+def render_page(page, dpi=OCR_DPI):
+    import fitz  # PyMuPDF
+
+    # Render straight to 8-bit grayscale: one byte per pixel is all Tesseract needs
+    pix = page.get_pixmap(colorspace=fitz.csGRAY, dpi=dpi)
+    return Image.frombuffer("L", (pix.width, pix.height), pix.samples, "raw", "L", pix.stride, 1)
+
+
+def iter_pages(doc, page_numbers):
+    # Render pages one at a time as the OCR step consumes them
+    for number in page_numbers:
+        yield render_page(doc[number])
+
+
+def render_thumbnail(page, dpi=PREVIEW_DPI):
+    pix = page.get_pixmap(dpi=dpi)
+    return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+
+
+# --- Persistence helper ---
+def write_files(writes):
+    # (path, bytes) pairs, written in one go from a background thread. The page has already
+    # rendered by then, so failures can only be logged.
+    for path, content in writes:
+        try:
+            Path(path).write_bytes(content)
+        except OSError:
+            logger.exception("Could not save %s", path)
+
+
 # --- Streamlit App ---
 st.title("📄 AI Invoice Scanner (Freelance-Ready + Cloud-Safe)")
 st.write("Upload an invoice (PDF or image), extract details, and download results.")
 
+psm = st.sidebar.selectbox(
+    "OCR page segmentation mode",
+    options=list(PSM_MODES),
+    format_func=PSM_MODES.get,
+    help="Change this only if the default misses text on unusual layouts.",
+)
+
 uploaded_file = st.file_uploader("Upload Invoice", type=["pdf", "png", "jpg", "jpeg"])
 
 if uploaded_file:
-    # Save uploaded file
+    # Everything below works from the bytes in memory; the copy in uploads/ is saved at the end
+    data = uploaded_file.getvalue()
     file_path = os.path.join("uploads", uploaded_file.name)
-    with open(file_path, "wb") as f:
-        f.write(uploaded_file.getbuffer())
+
+    # Same file (+ same PSM, when OCR is involved) -> same key, so reruns reuse the cached
+    # text and saved results. Embedded PDF text does not depend on the PSM.
+    upload_key = hashlib.blake2b(data, digest_size=16).hexdigest()
+    ocr_key = f"{upload_key}_psm{psm}"
+    ocr_cache_path = Path(OCR_CACHE_DIR) / f"{ocr_key}.txt"
+    result_key = upload_key
 
     text = ""
-    images = []
+    thumbnails = []
+    ocr_failed = False  # results from a failed OCR run are shown but never saved
 
     if uploaded_file.type == "application/pdf":
         # Open PDF with PyMuPDF
-        doc = fitz.open(stream=open(file_path, "rb").read(), filetype="pdf")
+        import fitz
+
+        doc = fitz.open(stream=data, filetype="pdf")
+        parts = []
         for page in doc:
-            text += page.get_text("text")  # Extract text
-            pix = page.get_pixmap()
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            images.append(img)
-
-        # OCR fallback if no text
-        if not text.strip():
-            st.warning("No embedded text found. Running OCR...")
-            for img in images:
-                try:
-                    text += pytesseract.image_to_string(img)
-                except Exception:
-                    st.error("⚠️ OCR not available here. Use PDF with embedded text or deploy with OCR API.")
-                    break
+            parts.append(page.get_text("text"))  # Extract text
+            thumbnails.append(render_thumbnail(page))
+
+        # OCR fallback, only for the pages without embedded text
+        ocr_needed = [i for i, part in enumerate(parts) if not part.strip()]
+        if ocr_needed:
+            result_key = ocr_key
+        if ocr_needed and ocr_cache_path.exists():
+            parts = [ocr_cache_path.read_text(encoding="utf-8")]
+        elif ocr_needed:
+            st.warning(f"No embedded text found on {len(ocr_needed)} of {len(doc)} page(s). Running OCR...")
+            workers = max(1, min(os.cpu_count() or 1, len(ocr_needed)))
+            try:
+                # The generator goes first so zip() exhausts it and its thread pool shuts down here
+                page_texts = ocr_pages(iter_pages(doc, ocr_needed), psm, workers)
+                for page_text, i in zip(page_texts, ocr_needed):
+                    parts[i] = page_text
+            except Exception:
+                st.error("⚠️ OCR not available here. Use PDF with embedded text or deploy with OCR API.")
+                ocr_failed = True
+            else:
+                ocr_cache_path.write_text("".join(parts), encoding="utf-8")
+        text = "".join(parts)
 
     else:
         # Handle image upload
-        image = Image.open(file_path)
+        image = Image.open(io.BytesIO(data))
         st.image(image, caption="Uploaded Invoice", use_column_width=True)
 
-        try:
-            text = pytesseract.image_to_string(image)
-        except Exception:
-            st.error("⚠️ OCR not available in this environment.")
-            text = ""
+        result_key = ocr_key
+        if ocr_cache_path.exists():
+            text = ocr_cache_path.read_text(encoding="utf-8")
+        else:
+            try:
+                text = ocr_image(image, psm)
+            except Exception:
+                st.error("⚠️ OCR not available in this environment.")
+                text = ""
+                ocr_failed = True
+            else:
+                ocr_cache_path.write_text(text, encoding="utf-8")
 
     # --- Display Results ---
     st.subheader("📝 Extracted Text")
@@ -121,31 +337,47 @@ if uploaded_file:
     st.json(fields)
 
     # --- Save extracted fields ---
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    json_path = f"processed/invoice_{timestamp}.json"
-    csv_path = f"processed/invoice_{timestamp}.csv"
+    # Serialize once and reuse the text for both the saved files and the downloads
+    json_text = json.dumps(fields, indent=2)
+    csv_buffer = io.StringIO()
+    writer = csv.writer(csv_buffer, lineterminator="\n")
+    writer.writerow(fields.keys())
+    writer.writerow(fields.values())
+    csv_text = csv_buffer.getvalue()
 
-    with open(json_path, "w") as f:
-        json.dump(fields, f, indent=2)
+    json_path = f"processed/invoice_{result_key}.json"
+    csv_path = f"processed/invoice_{result_key}.csv"
 
-    pd.DataFrame([fields]).to_csv(csv_path, index=False)
+    # Save the upload and results on one background thread so the writes don't block rendering
+    writes = []
+    # The upload is written once per content hash, not on every widget-triggered rerun
+    saved_uploads = st.session_state.setdefault("saved_uploads", {})
+    if saved_uploads.get(file_path) != upload_key:
+        writes.append((file_path, data))
+        saved_uploads[file_path] = upload_key
+    # Skip if already saved for this upload on an earlier rerun; a failed OCR run is never saved,
+    # so a later successful run can still write the real results
+    if not ocr_failed and not os.path.exists(json_path):
+        writes += [(json_path, json_text.encode("utf-8")), (csv_path, csv_text.encode("utf-8"))]
+    if writes:
+        threading.Thread(target=write_files, args=(writes,)).start()
 
     # --- Downloads ---
     st.download_button(
         "💾 Download Extracted Fields (JSON)",
-        data=json.dumps(fields, indent=2),
+        data=json_text,
         file_name="invoice_fields.json",
         mime="application/json",
     )
 
     st.download_button(
         "📊 Download Extracted Fields (CSV)",
-        data=pd.DataFrame([fields]).to_csv(index=False),
+        data=csv_text,
         file_name="invoice_fields.csv",
         mime="text/csv",
     )
 
     # --- Show Preview ---
-    if images:
+    if thumbnails:
         st.subheader("🖼️ Invoice Preview")
-        st.image(images, caption=[f"Page {i+1}" for i in range(len(images))])
\ No newline at end of file
+        st.image(thumbnails, caption=[f"Page {i+1}" for i in range(len(thumbnails))])
\ No newline at end of file
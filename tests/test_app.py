@@ -0,0 +1,133 @@
+import threading
+import time
+from pathlib import Path
+
+import fitz
+import pytesseract
+import pytest
+from streamlit.testing.v1 import AppTest
+
+APP = Path(__file__).resolve().parents[1] / "app.py"
+PROCESSED = APP.parent / "processed"
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    # app.py writes to uploads/ and processed/ relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def make_pdf(pages):
+    # One page per entry: a string becomes embedded text, a number a blank (scanned) page
+    # of that width in points
+    doc = fitz.open()
+    for page_spec in pages:
+        if isinstance(page_spec, str):
+            doc.new_page().insert_text((72, 72), page_spec)
+        else:
+            doc.new_page(width=page_spec)
+    return doc.tobytes()
+
+
+# Mixed PDF: embedded text on pages 1 and 3, scans of different widths on pages 2 and 4
+MIXED_PDF = make_pdf(["Invoice #MIX-1", 300, "Total Amount: $42.00", 500])
+
+
+@pytest.fixture
+def ocr_calls(monkeypatch):
+    # Stub Tesseract: name each scanned page by its rendered width. The narrow page is the
+    # slowest, so parallel OCR finishes out of page order.
+    calls = []
+
+    def image_to_string(image, lang=None, config=None):
+        calls.append(image.width)
+        if image.width < 1000:
+            time.sleep(0.2)
+            return "scan-narrow\n"
+        return "scan-wide\n"
+
+    monkeypatch.setattr(pytesseract, "image_to_string", image_to_string)
+    return calls
+
+
+def upload(data, name="invoice.pdf", mime="application/pdf"):
+    at = AppTest.from_file(str(APP), default_timeout=30).run()
+    at.file_uploader[0].upload(name, data, mime).run()
+    wait_for_writes()
+    return at
+
+
+def wait_for_writes():
+    # Results are saved from a background thread started by the script run
+    for thread in threading.enumerate():
+        if thread.name.endswith("(write_files)"):
+            thread.join(timeout=10)
+
+
+def saved_results(workdir):
+    return sorted(path.name for path in (workdir / "processed").glob("invoice_*"))
+
+
+def test_saved_files_match_existing_exports_byte_for_byte(workdir):
+    # Same fields as the committed processed/invoice_20250822_110635.* pair
+    at = upload(make_pdf(["INVOICE\nInvoice Date: 2025-08-18"]))
+    assert not at.exception
+
+    names = saved_results(workdir)
+    assert len(names) == 2
+    for name in names:
+        suffix = Path(name).suffix
+        expected = (PROCESSED / f"invoice_20250822_110635{suffix}").read_bytes()
+        assert (workdir / "processed" / name).read_bytes() == expected
+
+
+def test_mixed_pdf_ocrs_only_scanned_pages_in_page_order(workdir, ocr_calls):
+    at = upload(MIXED_PDF)
+    assert not at.exception
+
+    assert len(ocr_calls) == 2
+    text = at.text[0].value
+    order = [text.index(part) for part in ("MIX-1", "scan-narrow", "Total Amount", "scan-wide")]
+    assert order == sorted(order)
+    assert at.json[0].value.count("MIX-1") == 1
+    assert len(saved_results(workdir)) == 2
+
+
+def test_failed_ocr_saves_nothing(workdir, monkeypatch):
+    def unavailable(image, lang=None, config=None):
+        raise pytesseract.TesseractNotFoundError()
+
+    monkeypatch.setattr(pytesseract, "image_to_string", unavailable)
+    at = upload(MIXED_PDF)
+
+    assert at.error
+    # Embedded pages are still shown, but neither results nor OCR cache are saved
+    assert "MIX-1" in at.text[0].value
+    assert saved_results(workdir) == []
+    assert list((workdir / "processed" / "ocr_cache").iterdir()) == []
+
+
+def test_successful_ocr_after_failure_is_saved(workdir, monkeypatch, ocr_calls):
+    with monkeypatch.context() as m:
+        m.setattr(pytesseract, "image_to_string", lambda *args, **kwargs: 1 / 0)
+        upload(MIXED_PDF)
+    assert saved_results(workdir) == []
+
+    upload(MIXED_PDF)
+    assert len(saved_results(workdir)) == 2
+
+
+def test_rerun_writes_no_duplicates(workdir, ocr_calls):
+    at = upload(MIXED_PDF)
+    results = saved_results(workdir)
+    saved_upload = workdir / "uploads" / "invoice.pdf"
+    upload_mtime = saved_upload.stat().st_mtime_ns
+    calls = len(ocr_calls)
+
+    at.run()
+    wait_for_writes()
+    assert saved_results(workdir) == results
+    assert saved_upload.stat().st_mtime_ns == upload_mtime
+    # The OCR cache serves the rerun
+    assert len(ocr_calls) == calls
@@ -0,0 +1,73 @@
+import random
+import re
+
+import pytest
+
+import app
+
+
+@pytest.fixture(params=["re", "re2"])
+def engine(request, monkeypatch):
+    # Run each test with the standard library and, when installed, with google-re2
+    module = pytest.importorskip(request.param)
+    monkeypatch.setattr(app, "re", module)
+    app.compile_fields_re.clear()
+    app.extract_invoice_fields.clear()
+    yield module
+    app.compile_fields_re.clear()
+    app.extract_invoice_fields.clear()
+
+
+def baseline_fields(text, engine=re):
+    # The original implementation: one independent search per field, no keyword prefilter
+    invoice = engine.search(r"(?i)(Invoice\s*#?:?\s*)([A-Za-z0-9\-]+)", text)
+    date = engine.search(r"(\d{2}[/-]\d{2}[/-]\d{4}|\d{4}[/-]\d{2}[/-]\d{2}|\d{1,2}\s+\w+\s+\d{4})", text)
+    total = engine.search(
+        r"(?i)(Total\s*Amount\s*:?|Grand\s*Total|Amount\s*Due|Balance)\s*\$?([\d,]+\.\d{2})",
+        text
+    )
+    return {
+        "Invoice Number": invoice.group(2) if invoice else None,
+        "Invoice Date": date.group(1) if date else None,
+        "Total Amount": total.group(2) if total else None,
+    }
+
+
+@pytest.mark.parametrize("text", [
+    "Invoice 12 Aug 2025\nTotal Amount: $100.00",
+    "Invoice #A-1\nItems 3 Balance 2000.00",
+    "Invoice 2025-08-18 Invoice #B-2 Grand Total 9.99 Total Amount: 5.00",
+    "Balance 10.00 invoice: A12 2025-08-01 invoice #B",
+    "Due 01/02/2024, issued 2023-12-31",
+    "Amount Due $1,000.00\nInvoice#INV-7\nDate 3 March 2024",
+    "nothing to see here",
+])
+def test_matches_baseline(engine, text):
+    assert app.extract_invoice_fields(text) == baseline_fields(text, engine)
+
+
+def test_keyword_prefilter_matches_unicode_case_folding(engine):
+    # Characters that (?i) folds onto ASCII letters must not make the prefilter drop a field
+    rng = random.Random(0)
+    tokens = ["Invoice", "INVOICE", "\u0130NVOICE", "\u0131nvoice", "\u0130nvo\u0131ce", "#A-1", "Total",
+              "AMOUNT", "Amount", "Due", "Grand", "Ba\u0131ance", "Balance", "12", "2000.00", "$5.00",
+              "Aug", "2025", "18/08/2025", "\u017f", "\u212a", ":", "\n"]
+    for _ in range(500):
+        text = " ".join(rng.choice(tokens) for _ in range(rng.randint(1, 12)))
+        assert app.extract_invoice_fields(text) == baseline_fields(text, engine), text
+
+
+def test_fields_found_case_insensitively(engine):
+    text = "INVOICE #INV-001\ndate: 18 Aug 2025\ngrand total $1,234.50"
+    assert app.extract_invoice_fields(text) == {
+        "Invoice Number": "INV-001",
+        "Invoice Date": "18 Aug 2025",
+        "Total Amount": "1,234.50",
+    }
+
+
+def test_blank_text_has_no_fields(engine):
+    assert app.extract_invoice_fields("  \n") == dict.fromkeys(
+        ["Invoice Number", "Invoice Date", "Total Amount"]
+    )
+
@@ -0,0 +1,50 @@
+from PIL import Image, ImageDraw
+
+import app
+
+
+def test_otsu_threshold_splits_bimodal_histogram():
+    histogram = [0] * 256
+    histogram[20], histogram[25] = 300, 100
+    histogram[220], histogram[230] = 200, 1000
+    assert 25 <= app.otsu_threshold(histogram) < 220
+
+
+def test_otsu_threshold_handles_blank_and_single_level_histograms():
+    assert app.otsu_threshold([0] * 256) == 0
+    histogram = [0] * 256
+    histogram[128] = 5000
+    assert app.otsu_threshold(histogram) == 0
+
+
+def page_with_ink(size):
+    image = Image.new("RGB", size, (235, 235, 235))
+    ImageDraw.Draw(image).rectangle((10, 10, size[0] // 3, size[1] // 3), fill=(15, 15, 15))
+    return image
+
+
+def test_prep_binarizes_ink_and_paper():
+    result = app.prep(page_with_ink((600, 400)))
+    assert result.mode == "1"
+    assert result.getpixel((20, 20)) == 0
+    assert result.getpixel((500, 300)) == 255
+
+
+def test_prep_caps_long_edge_and_keeps_aspect_ratio():
+    assert app.prep(page_with_ink((4000, 3000))).size == (app.MAX_OCR_EDGE, 1500)
+    assert app.prep(page_with_ink((1500, 4000))).size == (750, app.MAX_OCR_EDGE)
+
+
+def test_prep_never_upscales():
+    assert app.prep(page_with_ink((800, 600))).size == (800, 600)
+
+
+def test_prep_without_max_edge_keeps_rendered_pdf_resolution():
+    page = page_with_ink((1654, 2339)).convert("L")
+    assert app.prep(page, None).size == (1654, 2339)
+
+
+def test_prep_blank_image():
+    result = app.prep(Image.new("L", (300, 200), 255))
+    assert result.mode == "1"
+    assert result.getcolors() == [(300 * 200, 255)]